@@ -1,13 +1,588 @@
 import os
+import functools
+import glob
+import re
+import collections
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 import numpy as np
 import soundfile as sf
-import sounddevice as sd
-import noisereduce as nr
-import matplotlib.pyplot as plt
+from noisereduce.spectralgate.stationary import SpectralGateStationary
+from scipy.fft import rfft, irfft, set_workers
+from scipy.signal import get_window
 import queue
 import threading
 import sys
-import time
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:   # optional: fall back to the vectorized NumPy scanner
+    HAVE_NUMBA = False
+
+    def njit(*args, **kwargs):
+        return lambda fn: fn
+
+
+@njit(cache=True, fastmath=True)
+def _scan_silence(data, window_size, stride, threshold, min_samples, latest):
+    """
+    Rolling-RMS silence scan over a flat float32 array.
+
+    Windows of `window_size` samples are visited every `stride` samples; a
+    window is silent when its RMS is below `threshold`. The window energy is
+    kept as a running sum of squares (leaving samples subtracted, entering
+    samples added), so each step costs O(stride) instead of O(window_size),
+    and it is compared against threshold**2 * window_size to skip the sqrt.
+
+    Returns (start, end) of the chosen silent run of at least `min_samples`
+    samples - the latest one if `latest`, else the longest - or (-1, -1).
+    With `latest` the windows are walked from the end backwards and the scan
+    stops at the first run that is long enough.
+    """
+    n = data.shape[0]
+    if n < window_size:
+        return -1, -1
+
+    limit = threshold * threshold * window_size
+    if latest:
+        return _scan_silence_latest(data, window_size, stride, limit, min_samples)
+
+    ss = 0.0
+    for k in range(window_size):
+        ss += data[k] * data[k]
+
+    best_start = -1
+    best_len = 0
+    run_start = -1
+    i = 0
+    while True:
+        if ss < limit:
+            if run_start < 0:
+                run_start = i
+        elif run_start >= 0:
+            # run ends at the first window whose energy rises above threshold
+            length = i - run_start
+            if length >= min_samples and length > best_len:
+                best_start, best_len = run_start, length
+            run_start = -1
+
+        nxt = i + stride
+        if nxt > n - window_size:
+            break
+        for k in range(i, nxt):
+            ss -= data[k] * data[k]
+        for k in range(i + window_size, nxt + window_size):
+            ss += data[k] * data[k]
+        i = nxt
+
+    if run_start >= 0:
+        # silence lasted until the last window
+        length = i + stride - run_start
+        if length >= min_samples and length > best_len:
+            best_start, best_len = run_start, length
+
+    if best_start < 0:
+        return -1, -1
+    return best_start, min(n, best_start + best_len)
+
+
+@njit(cache=True, fastmath=True)
+def _scan_silence_latest(data, window_size, stride, limit, min_samples):
+    """
+    Backward variant of _scan_silence for the latest silent run: the rolling
+    energy moves from the last window towards the start and returns as soon
+    as a run of at least `min_samples` samples is closed.
+    """
+    n = data.shape[0]
+    i = ((n - window_size) // stride) * stride
+    ss = 0.0
+    for k in range(i, i + window_size):
+        ss += data[k] * data[k]
+
+    run_last = -1   # start of the last silent window of the current run
+    while True:
+        if ss < limit:
+            if run_last < 0:
+                run_last = i
+        elif run_last >= 0:
+            # run begins at the window after this loud one
+            run_start = i + stride
+            length = run_last + stride - run_start
+            if length >= min_samples:
+                return run_start, min(n, run_start + length)
+            run_last = -1
+
+        if i < stride:
+            break
+        prv = i - stride
+        for k in range(prv, i):
+            ss += data[k] * data[k]
+        for k in range(prv + window_size, i + window_size):
+            ss -= data[k] * data[k]
+        i = prv
+
+    if run_last >= 0:
+        # silence reaches back to the first window
+        length = run_last + stride
+        if length >= min_samples:
+            return 0, min(n, length)
+    return -1, -1
+
+
+if HAVE_NUMBA:
+    # compile at import so the JIT cost isn't paid on the first audio chunk
+    _scan_silence(np.zeros(1024, dtype=np.float32), 64, 32, 0.0, 1, True)
+
+
+def _scan_silence_numpy(data, window_size, stride, threshold, min_samples, latest):
+    """
+    Vectorized NumPy version of _scan_silence, used when numba is missing.
+    Window energies are differences of one float64 cumulative sum of squares
+    (O(N) total, same accumulator precision as the kernel); silent runs are
+    found with np.diff on the boolean mask. Same return convention.
+    """
+    n = data.shape[0]
+    if n < window_size:
+        return -1, -1
+
+    cum = np.empty(n + 1, dtype=np.float64)
+    cum[0] = 0.0
+    np.cumsum(np.square(data, dtype=np.float64), out=cum[1:])
+    starts = np.arange(0, n - window_size + 1, stride)
+    energy = cum[starts + window_size] - cum[starts]
+    silent = energy < threshold * threshold * window_size
+
+    # run boundaries in window units: +1 where a run starts, -1 after it ends
+    edges = np.diff(silent.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    run_starts = np.flatnonzero(edges == 1)
+    run_ends = np.flatnonzero(edges == -1)
+    lengths = (run_ends - run_starts) * stride
+    valid = np.flatnonzero(lengths >= min_samples)
+    if len(valid) == 0:
+        return -1, -1
+
+    pick = valid[-1] if latest else valid[np.argmax(lengths[valid])]
+    start = int(run_starts[pick]) * stride
+    return start, min(n, start + int(lengths[pick]))
+
+
+# "first_X" / "last_X" noise_profile_mode specs (X in seconds, optional "s")
+_PROFILE_SPAN_RE = re.compile(r'^(first|last)_(\d*\.?\d+)s?$')
+
+
+def _to_mono(block):
+    """Downmix a (frames, channels) float32 block to a 1-D float32 array."""
+    if block.ndim == 1:
+        return block
+    if block.shape[1] == 1:
+        return block[:, 0]
+    if block.shape[1] == 2:
+        # stereo: one add + scale beats a reduction over a length-2 axis
+        mono = np.add(block[:, 0], block[:, 1], dtype=np.float32)
+        mono *= np.float32(0.5)
+        return mono
+    return block.mean(axis=1, dtype=np.float32)
+
+
+@functools.lru_cache(maxsize=8)
+def _load_noise_file(abs_path, mtime):
+    """
+    Decode a noise-profile file to mono float32. Cached on (path, mtime), so
+    batch runs reuse the decoded profile and edits to the file invalidate it.
+    The returned array is shared between calls and therefore read-only.
+    """
+    prof, _ = sf.read(abs_path, dtype='float32', always_2d=True)
+    prof = np.ascontiguousarray(_to_mono(prof))
+    prof.flags.writeable = False
+    return prof
+
+
+@functools.lru_cache(maxsize=8)
+def _hann_window(n):
+    """
+    Periodic float32 Hann window of length `n`, built once per size and
+    shared (read-only) by every denoiser instance.
+    """
+    win = get_window("hann", n).astype(np.float32)
+    win.flags.writeable = False
+    return win
+
+
+def _open_output(path, rate):
+    """
+    Open `path` for mono writes as chunks are produced (creating missing
+    parent dirs), so the written audio never has to be held in memory.
+    """
+    out_dir = os.path.dirname(path)
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    return sf.SoundFile(path, 'w', samplerate=rate, channels=1)
+
+
+def _close_output(writer):
+    """
+    Close a writer from _open_output and return the number of frames written;
+    a file that received no frames is removed.
+    """
+    written = writer.frames
+    writer.close()
+    if written == 0:
+        os.remove(writer.name)
+    return written
+
+
+def _mean_square(x):
+    """Mean square of a 1-D array in a single pass (dot product, no squared temporary)."""
+    if len(x) == 0:
+        return 0.0
+    return float(np.dot(x, x) / len(x))
+
+
+def _region_means(data, regions):
+    """
+    Clip (start, end) regions to `data` and return (regions, mean |amplitude|)
+    for the non-empty ones, computed with a single reduceat over the
+    concatenated region samples.
+    """
+    n = len(data)
+    kept = [(max(0, int(s)), min(n, int(e))) for (s, e) in regions]
+    kept = [(s, e) for (s, e) in kept if s < e]
+    if not kept:
+        return [], np.empty(0)
+    lengths = np.array([e - s for (s, e) in kept])
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    samples = np.abs(np.concatenate([data[s:e] for (s, e) in kept]))
+    return kept, np.add.reduceat(samples, offsets, dtype=np.float64) / lengths
+
+
+def _plot_noise_regions(data, rate, noise_regions, title, plot_path=None):
+    """
+    Plot the (decimated) waveform with noise-profile regions highlighted and
+    labelled with their average amplitude. With `plot_path` the figure is
+    rendered off-screen on the Agg canvas and saved; otherwise it is shown.
+    matplotlib is imported here so runs without visualization never load it.
+    """
+    if plot_path:
+        # headless save: no pyplot state or GUI backend involved
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        fig = Figure(figsize=(16, 4))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+    else:
+        import matplotlib.pyplot as plt
+        fig, ax = plt.subplots(figsize=(16, 4))
+
+    # a 16-inch figure can't show more than a few thousand points: draw the
+    # min/max envelope of `decim`-sample columns so peaks aren't aliased away
+    decim = max(1, len(data) // 4000)
+    if decim > 1:
+        cols = data[:len(data) // decim * decim].reshape(-1, decim)
+        t = (np.arange(len(cols)) * decim + decim / 2) / rate
+        ax.fill_between(t, cols.min(axis=1), cols.max(axis=1),
+                        label="Original Audio", alpha=0.6, linewidth=0, rasterized=True)
+    else:
+        ax.plot(np.arange(len(data)) / rate, data,
+                label="Original Audio", alpha=0.6, linewidth=0.5, rasterized=True)
+
+    heights = [0.25, 0.5, 0.75, 1.0]
+    height_idx = 0
+    # two reductions instead of materializing np.abs(data)
+    data_max = max(abs(float(data.min())), abs(float(data.max()))) if len(data) > 0 else 1.0
+
+    regions, avg_amps = _region_means(data, noise_regions)
+    for (s, e), avg_amp in zip(regions, avg_amps):
+        ax.axvspan(s / rate, e / rate, color="red", alpha=0.3, label="Noise Profile")
+        mid_t = (s + e) / (2 * rate)
+        h_factor = heights[height_idx % len(heights)]
+        height_idx += 1
+        ax.text(mid_t, h_factor * data_max, f"Avg={avg_amp:.4f}",
+                ha="center", va="bottom", fontsize=9,
+                bbox=dict(facecolor="white", alpha=0.6, edgecolor="none"))
+
+    ax.set_title(title)
+    ax.set_xlabel("Time (s)")
+    ax.set_ylabel("Amplitude")
+    handles, labels = ax.get_legend_handles_labels()
+    by_label = dict(zip(labels, handles))
+    ax.legend(by_label.values(), by_label.keys())
+    fig.tight_layout()
+    if plot_path:
+        fig.savefig(plot_path, dpi=100)
+        print(f"[PLOT] Saved plot to {plot_path}")
+    else:
+        plt.show()
+        # non-interactive backends return immediately; don't leak the figure
+        plt.close(fig)
+
+
+def _put_drop_oldest(q, item):
+    """
+    Put into a bounded queue, discarding the oldest items when it is full.
+    Returns the number of items dropped.
+    """
+    dropped = 0
+    while True:
+        try:
+            q.put_nowait(item)
+            return dropped
+        except queue.Full:
+            try:
+                q.get_nowait()
+                dropped += 1
+            except queue.Empty:
+                pass
+
+
+def estimate_noise_profile(data, rate, noise_amp_threshold, min_noise_duration, latest=False):
+    """
+    Scan `data` and return (profile_array, start_idx, end_idx).
+    If latest=True choose the latest valid silence region (highest start idx).
+    If none found, return (None, None, None).
+    """
+    if data is None or len(data) == 0:
+        return None, None, None
+
+    window_size = max(1, int(0.05 * rate))   # 50ms windows
+    stride = max(1, window_size // 2)
+    min_samples = max(1, int(min_noise_duration * rate))
+
+    data = np.ascontiguousarray(data, dtype=np.float32)
+    scan = _scan_silence if HAVE_NUMBA else _scan_silence_numpy
+    start, end = scan(data, window_size, stride, float(noise_amp_threshold), min_samples, latest)
+    if start < 0:
+        # no valid region found
+        return None, None, None
+
+    return data[start:end].copy(), start, end
+
+
+def _latest_silence_in_file(f, total_samples, rate, noise_amp_threshold, min_noise_duration, block_samples):
+    """
+    Streaming equivalent of estimate_noise_profile(whole file, latest=True).
+    The analysis windows are read from `f` in batches of about `block_samples`
+    samples (always at least one window per batch), walking from the end of
+    the file backwards. A silent run touching the start of a batch is carried
+    into the previous one, so the runs are the ones the full-file scan sees,
+    and the scan stops at the first run that is long enough.
+    Returns (profile_array, start_idx, end_idx) or (None, None, None).
+    """
+    window_size = max(1, int(0.05 * rate))   # 50ms windows
+    stride = max(1, window_size // 2)
+    min_samples = max(1, int(min_noise_duration * rate))
+    limit = float(noise_amp_threshold) ** 2 * window_size
+    if total_samples < window_size:
+        return None, None, None
+
+    def region(first, count):
+        start = first * stride
+        end = min(total_samples, start + count * stride)
+        f.seek(start)
+        profile = _to_mono(f.read(end - start, dtype='float32', always_2d=True))
+        return np.ascontiguousarray(profile), start, end
+
+    n_windows = (total_samples - window_size) // stride + 1
+    per_block = max(1, block_samples // stride)
+    carry = 0   # silent windows from k1 on whose run may begin before k1
+    k1 = n_windows
+    while k1 > 0:
+        k0 = max(0, k1 - per_block)
+        f.seek(k0 * stride)
+        x = _to_mono(f.read((k1 - 1 - k0) * stride + window_size, dtype='float32', always_2d=True))
+        energy = np.lib.stride_tricks.sliding_window_view(np.square(x, dtype=np.float64), window_size)[::stride].sum(axis=1)
+        edges = np.diff((energy < limit).view(np.int8), prepend=0, append=0)
+        starts = np.flatnonzero(edges == 1)
+        counts = np.flatnonzero(edges == -1) - starts
+        if carry:
+            if len(starts) and starts[-1] + counts[-1] == k1 - k0:
+                counts[-1] += carry
+            elif carry * stride >= min_samples:
+                # the carried run begins exactly at the batch edge
+                return region(k1, carry)
+        carry = 0
+        for j in range(len(starts) - 1, -1, -1):
+            if starts[j] == 0 and k0 > 0:
+                # the run may reach back into the previous batch
+                carry = int(counts[j])
+                break
+            if counts[j] * stride >= min_samples:
+                return region(k0 + int(starts[j]), int(counts[j]))
+        k1 = k0
+    return None, None, None
+
+
+class GrowableF32:
+    """
+    Append-only float32 sample buffer.
+    Capacity doubles on overflow; `buf[:n]` holds the samples retained so far.
+    With `keep` set, an overflow first drops everything but the last `keep`
+    samples (capacity stays at least 2 * keep, so the shift is amortized);
+    `offset` is the global sample index of `buf[0]`.
+    """
+
+    def __init__(self, capacity=1 << 16, keep=None):
+        self.buf = np.empty(max(1, int(capacity)), dtype=np.float32)
+        self.n = 0
+        self.keep = keep
+        self.offset = 0
+
+    def __len__(self):
+        return self.n
+
+    def append(self, arr):
+        end = self.n + len(arr)
+        if end > len(self.buf):
+            drop = self.n - self.keep if self.keep is not None and self.n > self.keep else 0
+            if drop:
+                cap = max(end - drop, 2 * self.keep)
+            else:
+                cap = max(end, 2 * len(self.buf))
+            if cap > len(self.buf):
+                grown = np.empty(cap, dtype=np.float32)
+                grown[:self.n - drop] = self.buf[drop:self.n]
+                self.buf = grown
+            else:
+                self.buf[:self.n - drop] = self.buf[drop:self.n]
+            self.n -= drop
+            self.offset += drop
+            end -= drop
+        self.buf[self.n:end] = arr
+        self.n = end
+
+    def since(self, start):
+        """View of the retained samples from global index `start` to the end."""
+        return self.buf[max(0, start - self.offset):self.n]
+
+
+class NoiseGate:
+    """
+    Stationary spectral gate built once per noise profile.
+    The noise STFT statistics are computed in the constructor; calling the
+    gate on a chunk only runs the chunk's own STFT/mask/ISTFT.
+    """
+
+    N_FFT = 1024
+
+    def __init__(self, noise_profile, rate):
+        if len(noise_profile) == 0:
+            raise ValueError("noise profile is empty")
+        self.noise_profile = noise_profile
+        # the noise STFT needs at least one full frame; pad like TorchNoiseGate
+        noise = np.pad(noise_profile, (0, max(0, 2 * self.N_FFT - len(noise_profile))))
+        # same settings nr.reduce_noise(..., stationary=True) uses by default
+        self._gate = SpectralGateStationary(
+            y=noise, sr=rate, y_noise=noise,
+            n_std_thresh_stationary=1.5, chunk_size=600000, clip_noise_stationary=True,
+            padding=30000, n_fft=self.N_FFT, win_length=None, hop_length=None,
+            time_constant_s=2.0, freq_mask_smooth_hz=500, time_mask_smooth_ms=50,
+            tmp_folder=None, prop_decrease=1.0, use_tqdm=False, n_jobs=1)
+
+    def __call__(self, chunk):
+        # zero-pad by one FFT window so short (tail) chunks still span a full frame
+        pad = self.N_FFT
+        padded = np.pad(chunk, pad)[np.newaxis, :]
+        return self._gate._do_filter(padded)[0, pad:pad + len(chunk)]
+
+
+class TorchNoiseGate:
+    """
+    Stationary spectral gate running on PyTorch (noisereduce's TorchGate).
+    Uses CUDA when available, otherwise the CPU. torch is imported lazily so
+    it stays an optional dependency.
+    """
+
+    N_FFT = 1024
+
+    def __init__(self, noise_profile, rate):
+        import torch
+        from noisereduce.torchgate import TorchGate
+        self._torch = torch
+        self.noise_profile = noise_profile
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._gate = TorchGate(sr=rate, nonstationary=False, n_std_thresh_stationary=1.5,
+                               prop_decrease=1.0, n_fft=self.N_FFT).to(self.device)
+        # TorchGate needs at least two windows of noise, batched like x as (1, n)
+        noise = np.pad(noise_profile, (0, max(0, 2 * self.N_FFT - len(noise_profile))))
+        self._noise = self._upload(noise)[None, :]
+
+    def _upload(self, x):
+        t = self._torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+        if self.device.type == "cuda":
+            t = t.pin_memory()
+        return t.to(self.device, non_blocking=True)
+
+    def __call__(self, chunk):
+        pad = self.N_FFT
+        x = self._upload(np.pad(chunk, pad))[None, :]
+        with self._torch.no_grad():
+            y = self._gate(x, self._noise)
+        return y[0, pad:pad + len(chunk)].cpu().numpy()
+
+
+class SpectralSubtractor:
+    """
+    Magnitude spectral subtraction with an in-house rFFT overlap-add.
+    The Hann window and the mean noise magnitude spectrum are computed once
+    per profile; each chunk is framed as a strided view, transformed with one
+    rfft call (threaded per the caller's scipy.fft set_workers), masked as a
+    single 2-D array and overlap-added back in FFTLEN // FRAMEINC vectorized
+    passes.
+    """
+
+    FFTLEN = 2048
+    FRAMEINC = FFTLEN // 4        # 75% overlap
+    # sum of overlapping periodic Hann windows at this hop
+    OLA_GAIN = FFTLEN / (2 * FRAMEINC)
+
+    def __init__(self, noise_profile, rate, alpha=2.0, beta=0.02):
+        self.noise_profile = noise_profile
+        self.rate = rate
+        self.alpha = alpha
+        self.beta = beta
+        self.window = _hann_window(self.FFTLEN)
+        spec, _ = self._spectrum(noise_profile)
+        self.noise_mag = np.abs(spec).mean(axis=0)
+        # per-bin subtraction term and spectral floor, fixed for this profile
+        self._sub = (alpha * self.noise_mag).astype(np.float32)
+        self._floor = (beta * self.noise_mag).astype(np.float32)
+
+    def _spectrum(self, x):
+        """Frame `x` (padded so every sample sees all overlaps) and rfft it."""
+        pad = self.FFTLEN - self.FRAMEINC
+        total = len(x) + 2 * pad
+        tail = pad + (-(total - self.FFTLEN)) % self.FRAMEINC
+        padded = np.pad(np.asarray(x, dtype=np.float32), (pad, tail))
+        frames = np.lib.stride_tricks.sliding_window_view(padded, self.FFTLEN)[::self.FRAMEINC]
+        return rfft(frames * self.window, axis=1), pad
+
+    def __call__(self, chunk):
+        spec, pad = self._spectrum(chunk)
+        mag = np.abs(spec)
+        # gain = max(mag - sub, floor) / mag, built in place in two buffers
+        gain = mag - self._sub
+        np.maximum(gain, self._floor, out=gain)
+        mag += 1e-12
+        gain /= mag
+        spec *= gain
+        frames = irfft(spec, n=self.FFTLEN, axis=1)
+
+        # overlap-add: frame f's j-th hop-sized block lands in output block f + j
+        n_frames = len(frames)
+        hops = self.FFTLEN // self.FRAMEINC
+        blocks = frames.reshape(n_frames, hops, self.FRAMEINC)
+        out = np.zeros((n_frames + hops - 1, self.FRAMEINC), dtype=np.float32)
+        for j in range(hops):
+            out[j:j + n_frames] += blocks[:, j]
+        out = out.reshape(-1)[pad:pad + len(chunk)]
+        out /= self.OLA_GAIN
+        return out
+
+
+DENOISERS = {
+    "spectral_gate": NoiseGate,
+    "spectral_subtraction": SpectralSubtractor,
+    "spectral_gate_torch": TorchNoiseGate,
+}
 
 
 def anc(input_source="mic",
@@ -23,7 +598,10 @@ def anc(input_source="mic",
         plot_path=None,
         device=None,
         duration=None,
-        adaptive_refresh_chunks=4):
+        adaptive_refresh_chunks=4,
+        denoise_method="spectral_gate",
+        max_stream_latency_ms=100,
+        file_workers=None):
     """
     Noise reduction (streaming/file) using a noise profile.
 
@@ -47,6 +625,26 @@ def anc(input_source="mic",
             - If no valid region is found, keeps the previous profile
             (logs this event)
 
+    - Denoising (denoise_method):
+        * "spectral_gate"        → stationary spectral gate (noisereduce)
+        * "spectral_subtraction" → magnitude spectral subtraction using the
+                                   mean noise spectrum (rFFT overlap-add)
+        * "spectral_gate_torch"  → stationary spectral gate on PyTorch
+                                   (GPU if CUDA is available; needs torch)
+
+    - File-mode parallelism (file_workers):
+        * Chunks are denoised on a pool of `file_workers` threads
+          (default: os.cpu_count()); each task keeps scipy.fft's default of
+          one FFT thread, so cores are not oversubscribed
+
+    - Stream latency (mic mode):
+        * Chunks waiting for playback are capped at
+          max(2, int(max_stream_latency_ms / 1000 / chunk_duration)); when
+          playback falls behind the oldest chunks are dropped (and logged)
+        * The cap never goes below 2 chunks, so the queued audio can reach
+          2 * chunk_duration (5 s with the default 2.5 s chunks) even when
+          max_stream_latency_ms is smaller; lower chunk_duration to tighten it
+
     - Silence detection:
         * Based on RMS amplitude compared to `noise_amp_threshold`
         * Minimum silence duration = `min_noise_duration` (in seconds)
@@ -77,396 +675,422 @@ def anc(input_source="mic",
     # Normalize "both" alias
     if output_mode == "both":
         output_mode = "stream+file"
+    # resolved once; the chunk loops branch on these flags only
+    emit_stream = output_mode in ("stream", "stream+file")
+    emit_file = output_mode in ("file", "stream+file")
 
     # Default microphone samplerate (used when input_source == "mic" and no file sets rate)
     DEFAULT_MIC_SR = 48000
 
     # Output buffers
-    output_audio = []     # processed audio samples
-    raw_audio = []        # raw samples (mono)
+    output_writer = None           # denoised audio is streamed to output_path
+    raw_writer = None              # raw audio is streamed to <output>_raw.wav
+    raw_audio = GrowableF32()      # raw samples (mono)
+    # raw samples are only kept in memory for the plot and adaptive refresh
+    # (save_raw_audio streams them to disk instead); without a plot, refresh
+    # only needs the last adaptive_refresh_chunks chunks (raw_audio.keep)
+    keep_raw = visualization or noise_profile_mode == "adaptive"
     stream_queue = queue.Queue()
     noise_regions = []    # list of (start_sample, end_sample) regions used as noise profile
 
     # Keep current noise profile (None until established)
     noise_profile = None
+    # Denoiser for the current noise profile (rebuilt when the profile changes)
+    if denoise_method not in DENOISERS:
+        raise ValueError(f"Unknown denoise_method: {denoise_method}")
+    make_denoiser = DENOISERS[denoise_method]
+
+    # squared threshold for the profile safety check (compare energies, no sqrt)
+    noise_thr2 = noise_amp_threshold * noise_amp_threshold
+    denoiser = None
+
+    try:
+        # ------- FILE mode -------
+        if input_source == "file":
+            if not input_path:
+                raise ValueError("input_path must be specified when input_source='file'")
+
+            # file chunks are independent once their noise profile is chosen, so
+            # denoising runs on a thread pool (the FFTs release the GIL); the
+            # pool is the only parallelism, each task's FFTs stay single-threaded
+            n_workers = file_workers or os.cpu_count() or 1
+            with sf.SoundFile(input_path) as f, ThreadPoolExecutor(max_workers=n_workers) as pool:
+                rate = f.samplerate
+                total_samples = f.frames
+
+                # apply duration limit if requested
+                if duration is not None:
+                    total_samples = min(total_samples, int(duration * rate))
+
+                chunk_samples = int(chunk_duration * rate)
+                if chunk_samples < 1:
+                    raise ValueError(f"chunk_duration={chunk_duration} is shorter than one sample at {rate} Hz")
+                if not visualization and noise_profile_mode == "adaptive":
+                    raw_audio.keep = adaptive_refresh_chunks * chunk_samples
+
+                # initial noise profile selection (only the needed region is read)
+                # spec strings are matched first; only anything else costs a stat()
+                span = _PROFILE_SPAN_RE.match(noise_profile_mode)
+                if span:
+                    part, sec = span.group(1), float(span.group(2))
+                    sample_count = min(int(sec * rate), total_samples)
+                    if part == "first":
+                        f.seek(0)
+                        noise_profile = _to_mono(f.read(sample_count, dtype='float32', always_2d=True))
+                        noise_regions.append((0, sample_count))
+                    else:
+                        f.seek(total_samples - sample_count)
+                        noise_profile = _to_mono(f.read(sample_count, dtype='float32', always_2d=True))
+                        noise_regions.append((total_samples - sample_count, total_samples))
+                    print(f"[INIT] noise profile taken from '{noise_profile_mode}'")
+                elif noise_profile_mode == "adaptive":
+                    # stream the whole file through the silence scan, at least a
+                    # second of audio per read, without keeping the decoded signal
+                    block_samples = max(chunk_samples * adaptive_refresh_chunks, rate)
+                    noise_profile, s, e = _latest_silence_in_file(f, total_samples, rate, noise_amp_threshold, min_noise_duration, block_samples)
+                    init_region = (s, e)
+                    if noise_profile is not None:
+                        noise_regions.append(init_region)
+                        print(f"[INIT] adaptive profile found in file at {init_region[0]}:{init_region[1]}")
+                    else:
+                        print("[INIT] adaptive requested but no valid profile found in whole file -> will wait for refresh (keep None)")
+                elif os.path.exists(noise_profile_mode):
+                    noise_path = os.path.abspath(noise_profile_mode)
+                    noise_profile = _load_noise_file(noise_path, os.path.getmtime(noise_path))
+                    noise_regions.append((0, len(noise_profile)))
+                    print("[INIT] noise profile loaded from file")
+                elif noise_profile_mode.startswith("first_") or noise_profile_mode.startswith("last_"):
+                    raise ValueError("Invalid first_/last_ noise_profile_mode format")
+                else:
+                    raise ValueError("Invalid noise_profile_mode value")
+
+                if emit_file and output_path:
+                    output_writer = _open_output(output_path, rate)
+                if save_raw_audio and output_path:
+                    raw_writer = _open_output(output_path.replace(".wav", "_raw.wav"), rate)
+
+                def emit(job):
+                    reduced = job.result() if isinstance(job, Future) else job
+                    # stream and/or write to the output file
+                    if emit_stream:
+                        stream_queue.put(reduced)
+                    if output_writer is not None:
+                        output_writer.write(reduced)
+
+                # Process file in chunks; adaptive refresh scans the last
+                # adaptive_refresh_chunks chunks straight out of raw_audio.
+                # Up to 2 * workers chunks are in flight; results are emitted in order.
+                max_in_flight = 2 * n_workers
+                pending = collections.deque()
+                chunk_count = 0
+                start = 0
+
+                f.seek(0)
+                for block in f.blocks(blocksize=chunk_samples, frames=total_samples, dtype='float32', always_2d=True):
+                    chunk = _to_mono(block)
+                    if keep_raw:
+                        raw_audio.append(chunk)
+                    if raw_writer is not None:
+                        raw_writer.write(chunk)
+
+                    # Attempt adaptive refresh every adaptive_refresh_chunks
+                    if noise_profile_mode == "adaptive" and (chunk_count % adaptive_refresh_chunks == 0):
+                        # global start of the recent window (view, no copy)
+                        recent_start = max(0, start - (adaptive_refresh_chunks - 1) * chunk_samples)
+                        recent_audio = raw_audio.since(recent_start)
+                        if len(recent_audio) > 0:
+                            prof, s_rel, e_rel = estimate_noise_profile(recent_audio, rate, noise_amp_threshold, min_noise_duration, latest=True)
+                            if prof is not None:
+                                # verify prof meets silence threshold (safety)
+                                prof_ms = _mean_square(prof)
+                                if prof_ms < noise_thr2:
+                                    # compute global indices:
+                                    global_s = recent_start + s_rel
+                                    global_e = recent_start + e_rel
+                                    # clamp
+                                    global_s = max(0, int(global_s))
+                                    global_e = min(total_samples, int(global_e))
+                                    noise_profile = prof
+                                    noise_regions.append((global_s, global_e))
+                                    print(f"[REFRESH] adaptive updated from file recent window -> global {global_s}:{global_e} (rms={np.sqrt(prof_ms):.6f})")
+                                else:
+                                    print(f"[REFRESH] candidate found but RMS {np.sqrt(prof_ms):.6f} >= noise_amp_threshold {noise_amp_threshold:.6f} -> keep old profile")
+                            else:
+                                print("[REFRESH] no candidate profile in recent chunks -> keep old profile")
+                        else:
+                            print("[REFRESH] recent window empty -> skip")
 
-    # helper: find latest valid silence region or fallback
-    def estimate_noise_profile(data, rate, noise_amp_threshold, min_noise_duration, latest=False):
-        """
-        Scan `data` and return (profile_array, start_idx, end_idx).
-        If latest=True choose the latest valid silence region (highest start idx).
-        If none found, return (None, None, None).
-        """
-        if data is None or len(data) == 0:
-            return None, None, None
-
-        window_size = max(1, int(0.05 * rate))   # 50ms windows
-        stride = max(1, window_size // 2)
-        min_samples = max(1, int(min_noise_duration * rate))
-
-        best_start = None
-        best_len = 0
-
-        i = 0
-        while i <= len(data) - window_size:
-            window = data[i:i + window_size]
-            rms = float(np.sqrt(np.mean(window ** 2)))
-            if rms < noise_amp_threshold:
-                start = i
-                # advance until window energy rises above threshold
-                while i <= len(data) - window_size:
-                    window2 = data[i:i + window_size]
-                    rms2 = float(np.sqrt(np.mean(window2 ** 2)))
-                    if rms2 >= noise_amp_threshold:
+                    # denoise chunk (if profile exists) with the profile current at this chunk
+                    if noise_profile is not None:
+                        if denoiser is None or denoiser.noise_profile is not noise_profile:
+                            denoiser = make_denoiser(noise_profile, rate)
+                        pending.append(pool.submit(denoiser, chunk))
+                    else:
+                        pending.append(chunk)
+                    while len(pending) > max_in_flight:
+                        emit(pending.popleft())
+
+                    start += len(chunk)
+                    chunk_count += 1
+
+                while pending:
+                    emit(pending.popleft())
+
+            # Visualization for file mode
+            if visualization:
+                _plot_noise_regions(raw_audio.buf[:raw_audio.n], rate, noise_regions,
+                                    "Audio Signal with Detected Noise Profile", plot_path)
+
+        # ------- MIC mode -------
+        elif input_source == "mic":
+            # imported here so file processing works without PortAudio installed
+            import sounddevice as sd
+
+            # use a practical mic rate
+            rate = DEFAULT_MIC_SR
+            chunk_samples = int(chunk_duration * rate)
+            if chunk_samples < 1:
+                raise ValueError(f"chunk_duration={chunk_duration} is shorter than one sample at {rate} Hz")
+            if not visualization and noise_profile_mode == "adaptive":
+                raw_audio.keep = adaptive_refresh_chunks * chunk_samples
+
+            # bounded playback queue: a stalled output device drops the oldest
+            # chunks so queued latency stays within max_stream_latency_ms
+            stream_maxsize = max(2, int(max_stream_latency_ms / 1000.0 / chunk_duration))
+            stream_queue = queue.Queue(maxsize=stream_maxsize)
+
+            # first_X seconds for the mic profile (parsed once; unparsable -> 0.5s)
+            prof_len_s = None
+            if isinstance(noise_profile_mode, str) and noise_profile_mode.startswith("first_"):
+                span = _PROFILE_SPAN_RE.match(noise_profile_mode)
+                prof_len_s = float(span.group(2)) if span else 0.5
+                if int(prof_len_s * rate) == 0:
+                    raise ValueError(f"noise_profile_mode '{noise_profile_mode}' selects an empty noise profile")
+
+            print(f"[MIC] Recording {'indefinitely' if duration is None else f'for {duration}s'} at {rate}Hz, chunk={chunk_duration}s ...")
+
+            # playback thread (consume stream_queue until the None sentinel)
+            def playback_thread():
+                with sd.OutputStream(samplerate=rate, channels=1, dtype='float32', latency='low') as out_stream:
+                    # every producer (denoisers, raw passthrough) yields float32
+                    while True:
+                        c = stream_queue.get()
+                        if c is None:
+                            break
+                        out_stream.write(c)
+
+            if emit_stream:
+                playback_t = threading.Thread(target=playback_thread, daemon=True)
+                playback_t.start()
+
+            recorded_samples = 0
+            chunk_count = 0
+            # raw frames handed from the audio callback to the denoise worker
+            in_queue = queue.SimpleQueue()
+
+            def mic_callback(indata, frames, tinfo, status):
+                nonlocal recorded_samples
+                if status:
+                    print("[MIC STATUS]", status)
+                # only copy the first channel out; all heavy work runs in denoise_thread
+                in_queue.put(indata[:, 0].copy())
+                recorded_samples += frames
+
+                # stop condition requested
+                if duration is not None and recorded_samples >= int(duration * rate):
+                    # signal main to stop by raising CallbackStop
+                    raise sd.CallbackStop()
+
+            # set by PortAudio once the stream ends (duration reached or device error),
+            # or by the denoise worker when it fails
+            stream_done = threading.Event()
+            worker_error = []
+
+            def denoise_thread():
+                try:
+                    # the only denoising thread in mic mode: let its FFTs use every core
+                    with set_workers(-1):
+                        denoise_chunks()
+                except BaseException as e:
+                    # stop recording instead of queueing frames nobody consumes
+                    worker_error.append(e)
+                    stream_done.set()
+
+            def denoise_chunks():
+                nonlocal noise_profile, denoiser, chunk_count
+                processed_samples = 0
+                stream_drops = 0
+                while True:
+                    chunk = in_queue.get()
+                    if chunk is None:
                         break
-                    i += stride
-                end = i
-                length = end - start
-                if length >= min_samples:
-                    if latest:
-                        # choose latest occurrence (overwrite)
-                        best_start, best_len = start, length
+                    # append raw audio (first_X also needs it until the profile is set)
+                    if keep_raw or (noise_profile is None and prof_len_s is not None):
+                        raw_audio.append(chunk)
+                    if raw_writer is not None:
+                        raw_writer.write(chunk)
+
+                    # initialize noise profile from first_{N} if requested and profile is still None
+                    if noise_profile is None and prof_len_s is not None:
+                        prof_samples = int(prof_len_s * rate)
+                        if len(raw_audio) >= prof_samples:
+                            noise_profile = raw_audio.buf[:prof_samples].copy()
+                            noise_regions.append((0, prof_samples))
+                            print(f"[INIT] noise profile initialized from first_{prof_len_s}s")
+
+                    # If noise_profile_mode == "adaptive", attempt refresh every adaptive_refresh_chunks
+                    if noise_profile_mode == "adaptive" and (chunk_count % adaptive_refresh_chunks == 0):
+                        # last adaptive_refresh_chunks chunks, as a view into raw_audio
+                        recent_start = max(0, processed_samples - (adaptive_refresh_chunks - 1) * chunk_samples)
+                        recent_audio = raw_audio.since(recent_start)
+                        if len(recent_audio) > 0:
+                            prof, s_rel, e_rel = estimate_noise_profile(recent_audio, rate, noise_amp_threshold, min_noise_duration, latest=True)
+                            if prof is not None:
+                                prof_ms = _mean_square(prof)
+                                if prof_ms < noise_thr2:
+                                    # global indices of the candidate region
+                                    global_s = max(0, int(recent_start + s_rel))
+                                    global_e = max(0, int(recent_start + e_rel))
+                                    noise_profile = prof
+                                    noise_regions.append((global_s, global_e))
+                                    print(f"[REFRESH] adaptive profile updated (mic) -> global {global_s}:{global_e} (rms={np.sqrt(prof_ms):.6f})")
+                                else:
+                                    print(f"[REFRESH] candidate found in recent_audio but RMS {np.sqrt(prof_ms):.6f} >= noise_amp_threshold {noise_amp_threshold:.6f} -> keep old profile")
+                            else:
+                                print("[REFRESH] no candidate profile found in recent chunks -> keep old profile")
+
+                    # denoise current chunk if we have a profile
+                    if noise_profile is not None:
+                        if denoiser is None or denoiser.noise_profile is not noise_profile:
+                            denoiser = make_denoiser(noise_profile, rate)
+                        reduced = denoiser(chunk)
                     else:
-                        # choose longest
-                        if length > best_len:
-                            best_start, best_len = start, length
-            else:
-                i += stride
+                        reduced = chunk
 
-        if best_start is not None:
-            prof = data[best_start: best_start + best_len].astype(np.float32)
-            return prof, best_start, best_start + best_len
+                    # stream/playback
+                    if emit_stream:
+                        dropped = _put_drop_oldest(stream_queue, reduced)
+                        if dropped:
+                            stream_drops += dropped
+                            print(f"[MIC] playback behind -> dropped {dropped} stale chunk(s) (total {stream_drops})")
 
-        # no valid region found
-        return None, None, None
+                    # write to the output file
+                    if output_writer is not None:
+                        output_writer.write(reduced)
 
-    # ------- FILE mode -------
-    if input_source == "file":
-        if not input_path:
-            raise ValueError("input_path must be specified when input_source='file'")
-
-        data, rate = sf.read(input_path, dtype='float32')
-        # convert to mono if needed
-        if data.ndim > 1:
-            data = np.mean(data, axis=1)
-        total_samples = len(data)
-
-        # apply duration limit if requested
-        if duration is not None:
-            max_samples = int(duration * rate)
-            data = data[:max_samples]
-            total_samples = len(data)
-
-        # initial noise profile selection
-        if os.path.exists(noise_profile_mode):
-            prof, _ = sf.read(noise_profile_mode, dtype='float32')
-            noise_profile = prof if prof.ndim == 1 else np.mean(prof, axis=1).astype(np.float32)
-            noise_regions.append((0, len(noise_profile)))
-            print("[INIT] noise profile loaded from file")
-        elif noise_profile_mode.startswith("first_") or noise_profile_mode.startswith("last_"):
-            try:
-                part, sec = noise_profile_mode.split("_")
-                sec = float(sec)
-            except Exception:
-                raise ValueError("Invalid first_/last_ noise_profile_mode format")
-            sample_count = int(sec * rate)
-            if part == "first":
-                noise_profile = data[:sample_count].astype(np.float32)
-                noise_regions.append((0, sample_count))
-            else:
-                noise_profile = data[-sample_count:].astype(np.float32)
-                noise_regions.append((total_samples - sample_count, total_samples))
-            print(f"[INIT] noise profile taken from '{noise_profile_mode}'")
-        elif noise_profile_mode == "adaptive":
-            prof, s, e = estimate_noise_profile(data, rate, noise_amp_threshold, min_noise_duration, latest=True)
-            if prof is not None:
-                noise_profile = prof
-                noise_regions.append((s, e))
-                print(f"[INIT] adaptive profile found in file at {s}:{e}")
-            else:
-                print("[INIT] adaptive requested but no valid profile found in whole file -> will wait for refresh (keep None)")
-        else:
-            raise ValueError("Invalid noise_profile_mode value")
-
-        # Process file in chunks, keeping recent_chunks window
-        chunk_samples = int(chunk_duration * rate)
-        recent_chunks = []
-        chunk_count = 0
-
-        for start in range(0, total_samples, chunk_samples):
-            chunk = data[start: start + chunk_samples].astype(np.float32)
-            raw_audio.extend(chunk.tolist())
-
-            # update recent window
-            recent_chunks.append(chunk.copy())
-            if len(recent_chunks) > adaptive_refresh_chunks:
-                recent_chunks.pop(0)
-            recent_audio = np.concatenate(recent_chunks) if len(recent_chunks) > 0 else np.array([])
-
-            # Attempt adaptive refresh every adaptive_refresh_chunks
-            if noise_profile_mode == "adaptive" and (chunk_count % adaptive_refresh_chunks == 0):
-                if len(recent_audio) > 0:
-                    prof, s_rel, e_rel = estimate_noise_profile(recent_audio, rate, noise_amp_threshold, min_noise_duration, latest=True)
-                    if prof is not None:
-                        # verify prof meets silence threshold (safety)
-                        prof_rms = float(np.sqrt(np.mean(prof ** 2)))
-                        if prof_rms < noise_amp_threshold:
-                            # compute global indices:
-                            recent_len = len(recent_audio)
-                            # global start of recent_audio:
-                            global_start = start - (recent_len - len(chunk))
-                            global_s = global_start + s_rel
-                            global_e = global_start + e_rel
-                            # clamp
-                            global_s = max(0, int(global_s))
-                            global_e = min(total_samples, int(global_e))
-                            noise_profile = prof
-                            noise_regions.append((global_s, global_e))
-                            print(f"[REFRESH] adaptive updated from file recent window -> global {global_s}:{global_e} (rms={prof_rms:.6f})")
-                        else:
-                            print(f"[REFRESH] candidate found but RMS {prof_rms:.6f} >= noise_amp_threshold {noise_amp_threshold:.6f} -> keep old profile")
-                    else:
-                        print("[REFRESH] no candidate profile in recent chunks -> keep old profile")
-                else:
-                    print("[REFRESH] recent window empty -> skip")
+                    processed_samples += len(chunk)
+                    chunk_count += 1
 
-            # denoise chunk (if profile exists)
-            if noise_profile is not None:
-                reduced = nr.reduce_noise(y=chunk, y_noise=noise_profile, sr=rate)
-            else:
-                reduced = chunk
-
-            # stream and/or append to file buffer
-            if output_mode in ("stream", "stream+file"):
-                stream_queue.put(reduced)
-            if output_mode in ("file", "stream+file"):
-                output_audio.extend(reduced.tolist())
-
-            chunk_count += 1
-            # simulate chunk-duration processing latency (keep behavior same as before)
-            time.sleep(chunk_duration)
-
-        # Visualization for file mode
-        if visualization:
-            times = np.linspace(0, len(data) / rate, num=len(data))
-            fig, ax = plt.subplots(figsize=(16, 4))
-            ax.plot(times, data, label="Original Audio", alpha=0.6)
-
-            heights = [0.25, 0.5, 0.75, 1.0]
-            height_idx = 0
-            data_max = np.max(np.abs(data)) if len(data) > 0 else 1.0
-
-            for (s, e) in noise_regions:
-                s = max(0, int(s))
-                e = min(len(data), int(e))
-                if s >= e:
-                    continue
-                ax.axvspan(s / rate, e / rate, color="red", alpha=0.3, label="Noise Profile")
-                avg_amp = float(np.mean(np.abs(data[s:e])))
-                mid_t = (s + e) / (2 * rate)
-                h_factor = heights[height_idx % len(heights)]
-                height_idx += 1
-                ax.text(mid_t, h_factor * data_max, f"Avg={avg_amp:.4f}",
-                        ha="center", va="bottom", fontsize=9,
-                        bbox=dict(facecolor="white", alpha=0.6, edgecolor="none"))
-
-            ax.set_title("Audio Signal with Detected Noise Profile")
-            ax.set_xlabel("Time (s)")
-            ax.set_ylabel("Amplitude")
-            handles, labels = ax.get_legend_handles_labels()
-            by_label = dict(zip(labels, handles))
-            ax.legend(by_label.values(), by_label.keys())
-            plt.tight_layout()
-            if plot_path:
-                plt.savefig(plot_path)
-                print(f"[PLOT] Saved plot to {plot_path}")
-                plt.close()
-            else:
-                plt.show()
+            if emit_file and output_path:
+                output_writer = _open_output(output_path, rate)
+            if save_raw_audio and output_path:
+                raw_writer = _open_output(output_path.replace(".wav", "_raw.wav"), rate)
 
-    # ------- MIC mode -------
-    elif input_source == "mic":
-        # use a practical mic rate
-        rate = DEFAULT_MIC_SR
-        chunk_samples = int(chunk_duration * rate)
+            denoise_t = threading.Thread(target=denoise_thread, daemon=True)
+            denoise_t.start()
 
-        print(f"[MIC] Recording {'indefinitely' if duration is None else f'for {duration}s'} at {rate}Hz, chunk={chunk_duration}s ...")
+            # open stream
+            try:
+                with sd.InputStream(samplerate=rate, channels=1, blocksize=chunk_samples, dtype='float32',
+                                    device=device, callback=mic_callback, latency='low',
+                                    finished_callback=stream_done.set):
+                    # block until the stream finishes or KeyboardInterrupt
+                    try:
+                        # the timeout only keeps ctrl+c responsive where a bare wait() can't be interrupted
+                        while not stream_done.wait(0.5):
+                            pass
+                    except KeyboardInterrupt:
+                        print("[MIC] stopped by user (KeyboardInterrupt)")
+            except Exception as e:
+                print("[ERROR] microphone input stream error:", e)
 
-        # playback thread (consume stream_queue)
-        stop_flag = False
+            # let the worker drain the frames already captured
+            in_queue.put(None)
+            denoise_t.join()
 
-        def playback_thread():
-            with sd.OutputStream(samplerate=rate, channels=1, dtype='float32') as out_stream:
-                while not stop_flag or not stream_queue.empty():
-                    try:
-                        c = stream_queue.get(timeout=0.1)
-                        # c should be numpy array float32
-                        out_stream.write(np.asarray(c, dtype=np.float32))
-                    except queue.Empty:
-                        time.sleep(0.01)
-
-        if output_mode in ("stream", "stream+file"):
-            playback_t = threading.Thread(target=playback_thread, daemon=True)
-            playback_t.start()
-
-        recorded_samples = 0
-        chunk_count = 0
-        recent_chunks = []
-
-        def mic_callback(indata, frames, tinfo, status):
-            nonlocal recorded_samples, noise_profile, chunk_count, recent_chunks, stop_flag
-            if status:
-                print("[MIC STATUS]", status)
-            # take first channel
-            chunk = indata[:, 0].astype(np.float32)
-            # append raw audio
-            raw_audio.extend(chunk.tolist())
-
-            # update recent_chunks rolling buffer
-            recent_chunks.append(chunk.copy())
-            if len(recent_chunks) > adaptive_refresh_chunks:
-                recent_chunks.pop(0)
-            recent_audio = np.concatenate(recent_chunks) if len(recent_chunks) > 0 else np.array([])
-
-            # initialize noise profile from first_{N} if requested and profile is still None
-            if noise_profile is None and isinstance(noise_profile_mode, str) and noise_profile_mode.startswith("first_"):
+            # ensure playback thread finishes (it drains queued chunks first)
+            if emit_stream and 'playback_t' in locals():
                 try:
-                    _, sec = noise_profile_mode.split("_")
-                    prof_len_s = float(sec)
-                except Exception:
-                    prof_len_s = 0.5
-                prof_samples = int(prof_len_s * rate)
-                if len(raw_audio) >= prof_samples:
-                    noise_profile = np.array(raw_audio[:prof_samples], dtype=np.float32)
-                    noise_regions.append((0, prof_samples))
-                    print(f"[INIT] noise profile initialized from first_{prof_len_s}s")
-
-            # If noise_profile_mode == "adaptive", attempt refresh every adaptive_refresh_chunks
-            if noise_profile_mode == "adaptive" and (chunk_count % adaptive_refresh_chunks == 0):
-                if len(recent_audio) > 0:
-                    prof, s_rel, e_rel = estimate_noise_profile(recent_audio, rate, noise_amp_threshold, min_noise_duration, latest=True)
-                    if prof is not None:
-                        prof_rms = float(np.sqrt(np.mean(prof ** 2)))
-                        if prof_rms < noise_amp_threshold:
-                            # compute global start index of recent_audio:
-                            start_idx = recorded_samples  # start of current chunk in global samples
-                            recent_len = len(recent_audio)
-                            global_start = start_idx - (recent_len - len(chunk))
-                            global_s = max(0, int(global_start + s_rel))
-                            global_e = max(0, int(global_start + e_rel))
-                            noise_profile = prof
-                            noise_regions.append((global_s, global_e))
-                            print(f"[REFRESH] adaptive profile updated (mic) -> global {global_s}:{global_e} (rms={prof_rms:.6f})")
-                        else:
-                            print(f"[REFRESH] candidate found in recent_audio but RMS {prof_rms:.6f} >= noise_amp_threshold {noise_amp_threshold:.6f} -> keep old profile")
-                    else:
-                        print("[REFRESH] no candidate profile found in recent chunks -> keep old profile")
+                    stream_queue.put(None, timeout=1.0)
+                except queue.Full:
+                    # playback stalled or gone: make room instead of blocking the caller
+                    _put_drop_oldest(stream_queue, None)
+                playback_t.join(timeout=1.0)
 
-            # denoise current chunk if we have a profile
-            if noise_profile is not None:
-                reduced = nr.reduce_noise(y=chunk, y_noise=noise_profile, sr=rate)
-            else:
-                reduced = chunk
+            if worker_error:
+                raise worker_error[0]
 
-            # stream/playback
-            if output_mode in ("stream", "stream+file"):
-                stream_queue.put(reduced)
+            # Visualization for mic mode
+            if visualization and len(raw_audio) > 0:
+                _plot_noise_regions(raw_audio.buf[:raw_audio.n], rate, noise_regions,
+                                    "Audio Signal with Detected Noise Profile (Mic)", plot_path)
 
-            # accumulate for file saving
-            if output_mode in ("file", "stream+file"):
-                output_audio.extend(reduced.tolist())
-
-            recorded_samples += len(chunk)
-            chunk_count += 1
+        else:
+            raise ValueError("input_source must be 'file' or 'mic'")
 
-            # stop condition requested
-            if duration is not None and recorded_samples >= int(duration * rate):
-                # signal main to stop by raising CallbackStop
-                raise sd.CallbackStop()
+        # ---- Save files ----
+        if output_writer is not None:
+            if _close_output(output_writer):
+                print(f"[FILE] Denoised audio saved to {output_path}")
+            else:
+                print("[FILE] No processed audio to save.")
 
-        # open stream
-        try:
-            with sd.InputStream(samplerate=rate, channels=1, blocksize=chunk_samples, dtype='float32',
-                                device=device, callback=mic_callback):
-                # block for duration or until KeyboardInterrupt
-                if duration is not None:
-                    sd.sleep(int(duration * 1000))
-                else:
-                    # allow ctrl+c to stop
-                    try:
-                        while True:
-                            time.sleep(0.1)
-                    except KeyboardInterrupt:
-                        print("[MIC] stopped by user (KeyboardInterrupt)")
-        except Exception as e:
-            print("[ERROR] microphone input stream error:", e)
-
-        # ensure playback thread finishes
-        stop_flag = True
-        if output_mode in ("stream", "stream+file") and 'playback_t' in locals():
-            playback_t.join(timeout=1.0)
-
-        # Visualization for mic mode
-        if visualization and len(raw_audio) > 0:
-            data_arr = np.asarray(raw_audio, dtype=np.float32)
-            times = np.linspace(0, len(data_arr) / rate, num=len(data_arr))
-            fig, ax = plt.subplots(figsize=(16, 4))
-            ax.plot(times, data_arr, label="Original Audio", alpha=0.6)
-
-            heights = [0.25, 0.5, 0.75, 1.0]
-            height_idx = 0
-            data_max = np.max(np.abs(data_arr)) if data_arr.size > 0 else 1.0
-
-            for (s, e) in noise_regions:
-                s = max(0, int(s)); e = min(len(data_arr), int(e))
-                if s >= e:
-                    continue
-                ax.axvspan(s / rate, e / rate, color="red", alpha=0.3, label="Noise Profile")
-                avg_amp = float(np.mean(np.abs(data_arr[s:e])))
-                mid_t = (s + e) / (2 * rate)
-                h_factor = heights[height_idx % len(heights)]
-                height_idx += 1
-                ax.text(mid_t, h_factor * data_max, f"Avg={avg_amp:.4f}",
-                        ha="center", va="bottom", fontsize=9,
-                        bbox=dict(facecolor="white", alpha=0.6, edgecolor="none"))
-
-            ax.set_title("Audio Signal with Detected Noise Profile (Mic)")
-            ax.set_xlabel("Time (s)")
-            ax.set_ylabel("Amplitude")
-            handles, labels = ax.get_legend_handles_labels()
-            by_label = dict(zip(labels, handles))
-            ax.legend(by_label.values(), by_label.keys())
-            plt.tight_layout()
-            if plot_path:
-                plt.savefig(plot_path)
-                print(f"[PLOT] Saved plot to {plot_path}")
-                plt.close()
+        if raw_writer is not None:
+            if _close_output(raw_writer):
+                print(f"[FILE] Raw audio saved to {raw_writer.name}")
             else:
-                plt.show()
+                print("[FILE] No raw audio to save.")
+    finally:
+        # on errors / ctrl+c the writers are still closed, so partial
+        # output keeps a valid header instead of leaking an open handle
+        for writer in (output_writer, raw_writer):
+            if writer is not None and not writer.closed:
+                _close_output(writer)
 
-    else:
-        raise ValueError("input_source must be 'file' or 'mic'")
-
-    # ---- Save files ----
-    if output_mode in ("file", "stream+file") and output_path:
-        # make sure output_audio is a numpy array
-        if len(output_audio) > 0:
-            out_arr = np.asarray(output_audio, dtype=np.float32)
-            sf.write(output_path, out_arr, rate)
-            print(f"[FILE] Denoised audio saved to {output_path}")
-        else:
-            print("[FILE] No processed audio to save.")
+    # return the queue for streaming consumption if requested
+    return stream_queue if emit_stream else None
 
-    if save_raw_audio and output_path:
-        raw_out = output_path.replace(".wav", "_raw.wav")
-        if len(raw_audio) > 0:
-            sf.write(raw_out, np.asarray(raw_audio, dtype=np.float32), rate)
-            print(f"[FILE] Raw audio saved to {raw_out}")
-        else:
-            print("[FILE] No raw audio to save.")
 
-    # return the queue for streaming consumption if requested
-    return stream_queue if output_mode in ("stream", "stream+file") else None
+def _anc_batch_one(job):
+    input_path, output_path, kwargs = job
+    anc(input_source="file", input_path=input_path, output_mode="file",
+        output_path=output_path, **kwargs)
+    return output_path
+
+
+def anc_batch(input_paths, output_dir, max_workers=None, **kwargs):
+    """
+    Denoise several files in parallel, one worker process per file.
+
+    - input_paths: list of .wav paths, or a glob pattern string
+    - output_dir: denoised files are written here under their input basename
+    - max_workers: number of processes (default: os.cpu_count())
+    - kwargs: any other anc() file-mode parameters (noise_profile_mode,
+      noise_amp_threshold, chunk_duration, ...); file_workers defaults to 1
+      since the processes already use every core. input_source, input_path,
+      output_mode and output_path are set per file and can't be passed.
+
+    Raises ValueError if two inputs share a basename (their outputs would
+    overwrite each other in output_dir).
+
+    Returns the list of output paths, in input order.
+    Uses worker processes: call it under `if __name__ == "__main__":` on
+    platforms that spawn them (Windows, macOS).
+    """
+    reserved = sorted(set(kwargs) & {"input_source", "input_path", "output_mode", "output_path"})
+    if reserved:
+        raise TypeError(f"anc_batch() sets {', '.join(reserved)} per file; don't pass them")
+    if isinstance(input_paths, str):
+        input_paths = sorted(glob.glob(input_paths))
+    output_paths = [os.path.join(output_dir, os.path.basename(p)) for p in input_paths]
+    clashes = sorted(o for o, n in collections.Counter(output_paths).items() if n > 1)
+    if clashes:
+        raise ValueError(f"inputs with the same basename would overwrite each other: {clashes}")
+    os.makedirs(output_dir, exist_ok=True)
+    kwargs = dict(kwargs, file_workers=kwargs.get("file_workers", 1))
+    jobs = [(p, o, kwargs) for p, o in zip(input_paths, output_paths)]
+    with ProcessPoolExecutor(max_workers=max_workers) as ex:
+        return list(ex.map(_anc_batch_one, jobs))
 
 
 # Example usage: